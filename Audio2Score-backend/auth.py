@@ -38,7 +38,7 @@ def get_password_hash(password: str) -> str:
     """
     # 將字串轉換為 bytes 並加密
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     
     # 返回字串格式
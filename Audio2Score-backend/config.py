@@ -16,15 +16,27 @@ class Settings:
     DB_NAME: str = os.getenv("DB_NAME", "audio2score")
     DB_USER: str = os.getenv("DB_USER", "postgres")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "")
+    # 從連線池取得連線的最長等待秒數，逾時回傳 503 而非無限排隊
+    DB_ACQUIRE_TIMEOUT: float = float(os.getenv("DB_ACQUIRE_TIMEOUT", "2.0"))
     
     # JWT 設定
     JWT_SECRET: str = os.getenv("JWT_SECRET", "your-secret-key-change-this")
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
     JWT_EXPIRATION_DAYS: int = int(os.getenv("JWT_EXPIRATION_DAYS", "7"))
     
+    # 密碼雜湊設定（bcrypt cost，每加 1 耗時加倍；互動式登入建議控制在 500ms 內）
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    
     # 伺服器設定
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
     PORT: int = int(os.getenv("PORT", "3000"))
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    
+    # 音訊轉換設定（每個工作程序都會載入 TensorFlow 與模型，記憶體用量大，預設只開 1 個；
+    # Windows 的 ProcessPoolExecutor 最多只支援 61 個工作程序）
+    CONVERSION_WORKERS: int = max(1, int(os.getenv("CONVERSION_WORKERS", "1")))
+    if os.name == "nt":
+        CONVERSION_WORKERS = min(CONVERSION_WORKERS, 61)
     
     @property
     def database_url(self) -> str:
@@ -5,11 +5,29 @@ import asyncpg
 from typing import Optional
 from config import settings
 
+# 熱門查詢：routes 共用同一查詢文字，asyncpg 依文字快取每條連線的 prepared statement
+USER_BY_ID_QUERY = "SELECT id, username, email, created_at FROM users WHERE id = $1"
+USER_BY_EMAIL_QUERY = "SELECT id, username, email, password_hash, created_at FROM users WHERE email = $1"
+# 不分大小寫版本：僅在 LOWER(email) 唯一索引建立成功時使用，否則可能對到多筆重複帳號
+USER_BY_EMAIL_CI_QUERY = "SELECT id, username, email, password_hash, created_at FROM users WHERE LOWER(email) = LOWER($1)"
+
+async def _init_connection(conn):
+    """新連線建立時預先 prepare 熱門查詢，第一個請求不必再解析/規劃"""
+    try:
+        # 以不存在的值執行，只為了讓語句進入連線的 statement cache
+        await conn.fetchrow(USER_BY_ID_QUERY, 0)
+        await conn.fetchrow(USER_BY_EMAIL_QUERY, "")
+        await conn.fetchrow(USER_BY_EMAIL_CI_QUERY, "")
+    except asyncpg.UndefinedTableError:
+        pass  # 首次啟動時 init_db 尚未建立表格
+
 class Database:
     """資料庫管理類別"""
     
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        # 登入使用的信箱查詢；init_db 確認不分大小寫索引存在後才切換為 USER_BY_EMAIL_CI_QUERY
+        self.user_by_email_query: str = USER_BY_EMAIL_QUERY
     
     async def connect(self):
         """建立資料庫連線池"""
@@ -28,7 +46,10 @@ class Database:
                     database=settings.DB_NAME,
                     min_size=1,
                     max_size=10,
-                    command_timeout=60
+                    command_timeout=60,
+                    # 每條連線快取的 prepared statement 數量，避免查詢被反覆 prepare
+                    statement_cache_size=1024,
+                    init=_init_connection
                 )
                 
                 # 測試連線
@@ -88,13 +109,21 @@ async def init_db():
                 )
             ''')
             
-            # 建立索引
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)
-            ''')
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)
-            ''')
+            # 建立不分大小寫的唯一索引（登入查詢 LOWER(email) 可走索引，
+            # 註冊時 ON CONFLICT 也會擋下僅大小寫不同的重複帳號）
+            try:
+                await conn.execute('''
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower ON users(LOWER(email))
+                ''')
+                database.user_by_email_query = USER_BY_EMAIL_CI_QUERY
+            except asyncpg.UniqueViolationError as e:
+                print(f"⚠️  現有資料有僅大小寫不同的重複信箱，登入維持區分大小寫: {e}")
+            try:
+                await conn.execute('''
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_lower ON users(LOWER(username))
+                ''')
+            except asyncpg.UniqueViolationError as e:
+                print(f"⚠️  現有資料有僅大小寫不同的重複使用者名稱，未建立不分大小寫索引: {e}")
             
             # 建立檔案記錄表格 (Library)
             await conn.execute('''
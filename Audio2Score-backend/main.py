@@ -4,10 +4,11 @@ FastAPI 主程式 - Audio2Score Backend
 """
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from datetime import datetime
 import uvicorn
+import asyncio
 import sys
 import os
 from contextlib import asynccontextmanager
@@ -23,7 +24,10 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from config import settings
 from database import database, init_db
-from routes import router as auth_router
+from routes import router as auth_router, shutdown_conversion_pool, periodic_cleanup
+
+# 讓 routes 等模組的 logger 也能輸出（uvicorn 只設定自己的 logger）
+logging.basicConfig(level=settings.LOG_LEVEL)
 
 # Lifespan 事件處理器
 @asynccontextmanager
@@ -34,11 +38,15 @@ async def lifespan(app: FastAPI):
     print("=" * 50)
     await database.connect()
     await init_db()
+    # 背景定期清理舊上傳檔案（保留最近24小時的檔案）
+    cleanup_task = asyncio.create_task(periodic_cleanup(max_age_hours=24))
     print("✅ 應用程式初始化完成")
     print("=" * 50)
     yield
     # Shutdown code
     print("🛑 Audio2Score Backend 停止中...")
+    cleanup_task.cancel()
+    shutdown_conversion_pool()
     await database.disconnect()
 
 # 建立 FastAPI 應用程式
@@ -46,7 +54,9 @@ app = FastAPI(
     title="Audio2Score API",
     description="Audio2Score 後端 API - Python FastAPI 版本",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson 原生支援 datetime / UUID，序列化比標準 json 快
+    default_response_class=ORJSONResponse
 )
 
 # CORS 設定（支援 ngrok 和前端）
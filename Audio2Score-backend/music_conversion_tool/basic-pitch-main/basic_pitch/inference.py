@@ -188,6 +188,7 @@ DEFAULT_MINIMUM_NOTE_LENGTH_MS = 127.7
 DEFAULT_MINIMUM_MIDI_TEMPO = 120
 DEFAULT_SONIFICATION_SAMPLERATE = 44100
 DEFAULT_OVERLAPPING_FRAMES = 30
+DEFAULT_TF_INFERENCE_BATCH_SIZE = 8
 DEFAULT_MIDI_VELOCITY_SCALE = 127
 
 
@@ -304,10 +305,27 @@ def run_inference(
     overlap_len = n_overlapping_frames * FFT_HOP
     hop_size = AUDIO_N_SAMPLES - overlap_len
 
+    # The TensorFlow saved model has a dynamic batch dimension, so windows are stacked and
+    # predicted together. The CoreML, TFLite and ONNX exports are fixed to a batch size of 1.
+    if model.model_type == Model.MODEL_TYPES.TENSORFLOW:
+        batch_size = DEFAULT_TF_INFERENCE_BATCH_SIZE
+    else:
+        batch_size = 1
+
     output: Dict[str, Any] = {"note": [], "onset": [], "contour": []}
-    for audio_windowed, _, audio_original_length in get_audio_input(audio_path, overlap_len, hop_size):
-        for k, v in model.predict(audio_windowed).items():
+    batch: List[npt.NDArray[np.float32]] = []
+
+    def predict_batch() -> None:
+        for k, v in model.predict(np.concatenate(batch)).items():
             output[k].append(v)
+        batch.clear()
+
+    for audio_windowed, _, audio_original_length in get_audio_input(audio_path, overlap_len, hop_size):
+        batch.append(audio_windowed)
+        if len(batch) == batch_size:
+            predict_batch()
+    if batch:
+        predict_batch()
 
     unwrapped_output = {
         k: unwrap_output(np.concatenate(output[k]), audio_original_length, n_overlapping_frames, hop_size)
@@ -25,12 +25,34 @@ import numpy as np
 import tensorflow as tf
 
 from basic_pitch import models
-from basic_pitch.callbacks import VisualizeCallback
 from basic_pitch.constants import DATASET_SAMPLING_FREQUENCY
 from basic_pitch.data import tf_example_deserialization
 
 logging.basicConfig(level=logging.INFO)
 
+try:
+    from basic_pitch.callbacks import VisualizeCallback
+
+    _VIZ_PRESENT = True
+except ImportError:
+    _VIZ_PRESENT = False
+    logging.warning(
+        "VisualizeCallback dependencies (mir_eval, librosa) are not installed. "
+        "Training will run without tensorboard visualizations."
+    )
+
+# 載入模型時可預期的失敗類型；其他例外（如 KeyboardInterrupt、MemoryError）直接拋出
+_MODEL_LOAD_ERRORS = (IOError, ValueError, tf.errors.NotFoundError)
+
+# 載入預訓練模型時需要的自定義對象（解決 lambda 函數問題）
+_CUSTOM_OBJECTS = {
+    "loss": models.loss,
+    "onset_loss": models.onset_loss,
+    "transcription_loss": models.transcription_loss,
+    "weighted_transcription_loss": models.weighted_transcription_loss,
+    "get_cqt": models.get_cqt,
+}
+
 
 def main(
     source: str,
@@ -50,6 +72,9 @@ def main(
     positive_onset_weight: float,
     pretrained_model_path: str = None,
     freeze_layers: bool = True,
+    debug_histograms: bool = False,
+    jit_compile: bool = False,
+    multi_gpu: bool = False,
 ) -> None:
     """Parse config and run training or evaluation.
 
@@ -72,6 +97,9 @@ def main(
         positive_onset_weight: weighting factor for the positive labels.
         pretrained_model_path: path to pre-trained model
         freeze_layers: whether to freeze early layers for fine-tuning
+        debug_histograms: whether to write per-epoch weight histograms to tensorboard
+        jit_compile: whether to compile the training step with XLA
+        multi_gpu: whether to replicate the model across all visible GPUs with MirroredStrategy
     """
     # configuration.add_externals()
     logging.info(f"source directory: {source}")
@@ -89,6 +117,9 @@ def main(
     logging.info(f"no_contours: {no_contours}")
     logging.info(f"weighted_onset_loss: {weighted_onset_loss}")
     logging.info(f"positive_onset_weight: {positive_onset_weight}")
+    logging.info(f"debug_histograms: {debug_histograms}")
+    logging.info(f"jit_compile: {jit_compile}")
+    logging.info(f"multi_gpu: {multi_gpu}")
 
     # ==================== 修正的模型加載部分 ====================
     
@@ -100,125 +131,119 @@ def main(
     
     logging.info(f"Loading pre-trained model from: {model_path}")
     
-    try:
-        # 方法1：直接加載整個預訓練模型（推薦）
-        logging.info("Method 1: Loading entire pre-trained model...")
-        
-        # 定義自定義對象（解決 lambda 函數問題）
-        from basic_pitch import models as bp_models
-        custom_objects = {
-            'loss': bp_models.loss,
-            'onset_loss': bp_models.onset_loss,
-            'transcription_loss': bp_models.transcription_loss,
-            'weighted_transcription_loss': bp_models.weighted_transcription_loss,
-            'get_cqt': bp_models.get_cqt,
-        }
-        
-        # 使用自定義對象加載模型
-        with tf.keras.utils.custom_object_scope(custom_objects):
-            model = tf.keras.models.load_model(model_path, compile=False)
+    # 多 GPU 訓練：模型、optimizer 與 compile 都必須在 strategy.scope() 內進行
+    strategy = tf.distribute.MirroredStrategy() if multi_gpu else tf.distribute.get_strategy()
+    # --batch-size 是每張 GPU 的批次大小，資料集使用全域批次大小
+    global_batch_size = batch_size * strategy.num_replicas_in_sync
+    logging.info(f"replicas: {strategy.num_replicas_in_sync}, global batch size: {global_batch_size}")
+
+    with strategy.scope():
+        try:
+            # 方法1：直接加載整個預訓練模型（推薦）
+            logging.info("Method 1: Loading entire pre-trained model...")
+
+            # 使用自定義對象加載模型
+            with tf.keras.utils.custom_object_scope(_CUSTOM_OBJECTS):
+                model = tf.keras.models.load_model(model_path, compile=False)
         
-        logging.info("✅ Pre-trained model loaded successfully via direct loading!")
+            logging.info("✅ Pre-trained model loaded successfully via direct loading!")
         
-        # 檢查模型輸出
-        print(f"Model input shape: {model.input_shape}")
-        print(f"Model output: {model.output_shape}")
+            # 檢查模型輸出
+            print(f"Model input shape: {model.input_shape}")
+            print(f"Model output: {model.output_shape}")
         
-        # 設置微調策略
-        if freeze_layers and len(model.layers) > 15:
-            # 凍結前2/3的層，只訓練後1/3的層
-            freeze_threshold = int(len(model.layers) * 2 / 3)
+            # 設置微調策略
+            if freeze_layers and len(model.layers) > 15:
+                # 凍結前2/3的層，只訓練後1/3的層
+                freeze_threshold = int(len(model.layers) * 2 / 3)
             
-            for i, layer in enumerate(model.layers):
-                if i < freeze_threshold:
-                    layer.trainable = False
-                else:
-                    layer.trainable = True
+                for i, layer in enumerate(model.layers):
+                    if i < freeze_threshold:
+                        layer.trainable = False
+                    else:
+                        layer.trainable = True
             
-            trainable_count = sum([1 for layer in model.layers if layer.trainable])
-            logging.info(f"🔒 Freezing enabled: {trainable_count}/{len(model.layers)} layers are trainable")
-        else:
-            # 所有層都可訓練
-            for layer in model.layers:
-                layer.trainable = True
-            logging.info(f"🔓 All {len(model.layers)} layers are trainable")
+                trainable_count = sum([1 for layer in model.layers if layer.trainable])
+                logging.info(f"🔒 Freezing enabled: {trainable_count}/{len(model.layers)} layers are trainable")
+            else:
+                # 所有層都可訓練
+                for layer in model.layers:
+                    layer.trainable = True
+                logging.info(f"🔓 All {len(model.layers)} layers are trainable")
         
-    except Exception as e:
-        logging.error(f"❌ Method 1 failed: {e}")
-        logging.info("Trying Method 2: Creating new model and loading weights...")
+        except _MODEL_LOAD_ERRORS as e:
+            logging.error(f"❌ Method 1 failed: {e}")
+            logging.info("Trying Method 2: Creating new model and loading weights...")
         
-        # 方法2：創建新模型並嘗試加載權重
-        try:
-            model = models.model(no_contours=no_contours)
+            # 方法2：創建新模型並嘗試加載權重
+            try:
+                model = models.model(no_contours=no_contours)
             
-            # 構建模型
-            dummy_input = tf.keras.Input(shape=model.input_shape[1:])
-            _ = model(dummy_input)
+                # 構建模型
+                dummy_input = tf.keras.Input(shape=model.input_shape[1:])
+                _ = model(dummy_input)
             
-            # 加載預訓練模型
-            pretrained_model = tf.keras.models.load_model(model_path, compile=False)
+                # 加載預訓練模型
+                pretrained_model = tf.keras.models.load_model(model_path, compile=False)
             
-            # 打印層信息進行調試
-            print(f"New model layers: {len(model.layers)}")
-            print(f"Pretrained model layers: {len(pretrained_model.layers)}")
+                # 打印層信息進行調試
+                print(f"New model layers: {len(model.layers)}")
+                print(f"Pretrained model layers: {len(pretrained_model.layers)}")
             
-            # 嘗試加載權重
-            successfully_loaded = 0
-            for i, new_layer in enumerate(model.layers):
-                new_weights = new_layer.get_weights()
-                if not new_weights:
-                    continue
+                # 嘗試加載權重
+                successfully_loaded = 0
+                for i, new_layer in enumerate(model.layers):
+                    new_weights = new_layer.get_weights()
+                    if not new_weights:
+                        continue
                     
-                # 尋找對應的層
-                for pretrained_layer in pretrained_model.layers:
-                    if pretrained_layer.name == new_layer.name:
-                        pretrained_weights = pretrained_layer.get_weights()
-                        if pretrained_weights:
-                            try:
-                                # 檢查形狀是否匹配
-                                if len(new_weights) == len(pretrained_weights):
-                                    shapes_match = True
-                                    for nw, pw in zip(new_weights, pretrained_weights):
-                                        if nw.shape != pw.shape:
-                                            shapes_match = False
-                                            break
+                    # 尋找對應的層
+                    for pretrained_layer in pretrained_model.layers:
+                        if pretrained_layer.name == new_layer.name:
+                            pretrained_weights = pretrained_layer.get_weights()
+                            if pretrained_weights:
+                                try:
+                                    # 檢查形狀是否匹配
+                                    if len(new_weights) == len(pretrained_weights):
+                                        shapes_match = True
+                                        for nw, pw in zip(new_weights, pretrained_weights):
+                                            if nw.shape != pw.shape:
+                                                shapes_match = False
+                                                break
                                     
-                                    if shapes_match:
-                                        new_layer.set_weights(pretrained_weights)
-                                        successfully_loaded += 1
-                                        print(f"✅ Loaded weights for layer {i}: {new_layer.name}")
+                                        if shapes_match:
+                                            new_layer.set_weights(pretrained_weights)
+                                            successfully_loaded += 1
+                                            print(f"✅ Loaded weights for layer {i}: {new_layer.name}")
+                                        else:
+                                            print(f"⚠️  Shape mismatch for layer {i}: {new_layer.name}")
+                                            print(f"    New: {[w.shape for w in new_weights]}")
+                                            print(f"    Pretrained: {[w.shape for w in pretrained_weights]}")
                                     else:
-                                        print(f"⚠️  Shape mismatch for layer {i}: {new_layer.name}")
-                                        print(f"    New: {[w.shape for w in new_weights]}")
-                                        print(f"    Pretrained: {[w.shape for w in pretrained_weights]}")
-                                else:
-                                    print(f"⚠️  Weight count mismatch for layer {i}: {new_layer.name}")
-                            except Exception as layer_error:
-                                print(f"❌ Error loading layer {i}: {layer_error}")
-                        break
+                                        print(f"⚠️  Weight count mismatch for layer {i}: {new_layer.name}")
+                                except ValueError as layer_error:
+                                    print(f"❌ Error loading layer {i}: {layer_error}")
+                            break
             
-            logging.info(f"Loaded {successfully_loaded} layers successfully")
+                logging.info(f"Loaded {successfully_loaded} layers successfully")
             
-            if successfully_loaded == 0:
-                logging.warning("⚠️  No weights loaded! Training from scratch.")
+                if successfully_loaded == 0:
+                    logging.warning("⚠️  No weights loaded! Training from scratch.")
         
-        except Exception as e2:
-            logging.error(f"❌ Method 2 failed: {e2}")
-            logging.info("Creating new model from scratch...")
-            model = models.model(no_contours=no_contours)
+            except _MODEL_LOAD_ERRORS as e2:
+                logging.error(f"❌ Method 2 failed: {e2}")
+                logging.info("Creating new model from scratch...")
+                model = models.model(no_contours=no_contours)
     
     # ==================== 計算初始損失 ====================
     
+    # input_shape / output_shape 每次存取都會走訪整個層圖，只讀取一次
     input_shape = list(model.input_shape)
     if input_shape[0] is None:
-        input_shape[0] = batch_size
+        input_shape[0] = global_batch_size
     logging.info("input_shape" + str(input_shape))
 
-    output_shape = model.output_shape
-    for k, v in output_shape.items():
-        output_shape[k] = list(v)
-        if v[0] is None:
-            output_shape[k][0] = batch_size
+    output_shape = {k: [global_batch_size if dim is None else dim for dim in v] for k, v in model.output_shape.items()}
     logging.info("output_shape" + str(output_shape))
     
     # ==================== 數據加載 ====================
@@ -227,7 +252,7 @@ def main(
     train_ds, validation_ds = tf_example_deserialization.prepare_datasets(
         source,
         shuffle_size,
-        batch_size,
+        global_batch_size,
         validation_steps,
         datasets_to_use,
         dataset_sampling_frequency,
@@ -245,6 +270,12 @@ def main(
         dataset_sampling_frequency=dataset_sampling_frequency,
     )
 
+    # 損失函數（初始損失計算與編譯共用同一組）
+    if no_contours:
+        loss = models.loss_no_contour(weighted=weighted_onset_loss, positive_weight=positive_onset_weight)
+    else:
+        loss = models.loss(weighted=weighted_onset_loss, positive_weight=positive_onset_weight)
+
     # ==================== 計算初始損失（重要！） ====================
     
     logging.info("Calculating initial loss...")
@@ -255,8 +286,9 @@ def main(
             predictions = model.predict(inputs, verbose=0)
             
             # 計算損失
-            loss_fn = models.loss
-            initial_loss = loss_fn(targets, predictions)
+            initial_loss = tf.add_n(
+                [tf.reduce_mean(loss_fn(targets[k], predictions[k])) for k, loss_fn in loss.items()]
+            )
             
             logging.info(f"🎯 Initial loss: {initial_loss.numpy():.4f}")
             
@@ -274,7 +306,12 @@ def main(
     timestamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M")
     tensorboard_log_dir = os.path.join(output, timestamp, "tensorboard")
     callbacks = [
-        tf.keras.callbacks.TensorBoard(log_dir=tensorboard_log_dir, histogram_freq=1),
+        # 權重直方圖每個 epoch 都要把所有變數複製回主機，只在除錯時開啟
+        tf.keras.callbacks.TensorBoard(
+            log_dir=tensorboard_log_dir,
+            histogram_freq=1 if debug_histograms else 0,
+            profile_batch=0,
+        ),
         tf.keras.callbacks.EarlyStopping(patience=25, verbose=2),
         tf.keras.callbacks.ReduceLROnPlateau(verbose=1, patience=10, factor=0.5),
         tf.keras.callbacks.ModelCheckpoint(filepath=os.path.join(output, timestamp, "model.best"), save_best_only=True),
@@ -285,7 +322,7 @@ def main(
     ]
     
     # 添加可視化回調（如果可用）
-    try:
+    if _VIZ_PRESENT:
         callbacks.append(
             VisualizeCallback(
                 train_visualization_ds,
@@ -295,23 +332,20 @@ def main(
                 not no_contours,
             )
         )
-    except:
-        logging.warning("VisualizeCallback not available")
-
-    # 損失函數
-    if no_contours:
-        loss = models.loss_no_contour(weighted=weighted_onset_loss, positive_weight=positive_onset_weight)
-    else:
-        loss = models.loss(weighted=weighted_onset_loss, positive_weight=positive_onset_weight)
 
     # 編譯模型（使用較小的學習率進行微調）
     fine_tune_lr = learning_rate * 0.1  # 微調時使用更小的學習率
     
-    model.compile(
-        loss=loss,
-        optimizer=tf.keras.optimizers.Adam(fine_tune_lr),
-        sample_weight_mode={"contour": None, "note": None, "onset": None},
-    )
+    # XLA 只在明確要求時開啟（需要 TF >= 2.8），避免舊版 TF 不支援此參數
+    compile_kwargs = {"jit_compile": True} if jit_compile else {}
+    # optimizer 建立時會綁定當下的 strategy，需在 scope 內建立才能讓 slot 變數被鏡像
+    with strategy.scope():
+        model.compile(
+            loss=loss,
+            optimizer=tf.keras.optimizers.Adam(fine_tune_lr),
+            sample_weight_mode={"contour": None, "note": None, "onset": None},
+            **compile_kwargs,
+        )
 
     logging.info("--- Model Training specs ---")
     logging.info(f"  train_ds: {train_ds}")
@@ -421,6 +455,24 @@ def console_entry_point() -> None:
         default=False,
         help="Do not freeze any layers (train all layers)",
     )
+    parser.add_argument(
+        "--debug-histograms",
+        action="store_true",
+        default=False,
+        help="if given, write per-epoch weight histograms to tensorboard (slow)",
+    )
+    parser.add_argument(
+        "--jit-compile",
+        action="store_true",
+        default=False,
+        help="if given, compile the training step with XLA (requires TF >= 2.8)",
+    )
+    parser.add_argument(
+        "--multi-gpu",
+        action="store_true",
+        default=False,
+        help="if given, train with tf.distribute.MirroredStrategy across all visible GPUs",
+    )
     parser.add_argument(
         "--debug-initial-loss",
         action="store_true",
@@ -464,6 +516,9 @@ def console_entry_point() -> None:
         args.positive_onset_weight,
         args.pretrained_model,
         not args.no_freeze,
+        args.debug_histograms,
+        args.jit_compile,
+        args.multi_gpu,
     )
 
 
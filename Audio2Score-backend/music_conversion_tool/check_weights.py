@@ -46,16 +46,17 @@ def verify_pretrained_model():
         layers_with_weights = 0
         
         for i, layer in enumerate(model.layers):
-            weights = layer.get_weights()
+            weights = layer.weights
             if weights:
                 layers_with_weights += 1
-                layer_params = sum([w.size for w in weights])
+                layer_params = sum([w.shape.num_elements() for w in weights])
                 total_params += layer_params
                 
                 # 檢查權重值是否為零（未訓練的指標）
+                # 在裝置上計數非零值，只把純量傳回主機
                 all_zeros = True
                 for w in weights:
-                    if not np.allclose(w, 0):
+                    if int(tf.math.count_nonzero(w).numpy()) > 0:
                         all_zeros = False
                         break
                 
@@ -74,20 +75,23 @@ def verify_pretrained_model():
         test_input = np.random.randn(1, 43844, 1).astype(np.float32)
         
         print("   運行推理...")
-        outputs = model.predict(test_input, verbose=0)
+        outputs = model(test_input, training=False)
         
         print("   推理結果:")
         for key, value in outputs.items():
-            mean_val = value.mean()
-            std_val = value.std()
-            zero_percent = np.mean(value == 0) * 100
+            # 統計量在裝置上計算，只取回純量
+            mean_val = float(tf.reduce_mean(value))
+            std_val = float(tf.math.reduce_std(value))
+            zero_percent = float(tf.reduce_mean(tf.cast(tf.equal(value, 0), tf.float32))) * 100
+            min_val = float(tf.reduce_min(value))
+            max_val = float(tf.reduce_max(value))
             
             print(f"     {key}:")
             print(f"       形狀: {value.shape}")
             print(f"       平均值: {mean_val:.6f}")
             print(f"       標準差: {std_val:.6f}")
             print(f"       零值比例: {zero_percent:.2f}%")
-            print(f"       範圍: [{value.min():.6f}, {value.max():.6f}]")
+            print(f"       範圍: [{min_val:.6f}, {max_val:.6f}]")
             
             # 分析輸出
             if mean_val < 0.1 or mean_val > 0.9:
@@ -104,25 +108,27 @@ def verify_pretrained_model():
         conv_layers = [layer for layer in model.layers if 'conv2d' in layer.name.lower()]
         
         for i, layer in enumerate(conv_layers[:3]):  # 檢查前3個卷積層
-            weights = layer.get_weights()
+            weights = layer.weights
             if weights and len(weights) >= 2:  # 權重和偏置
                 kernel = weights[0]
                 bias = weights[1] if len(weights) > 1 else None
+                kernel_mean = float(tf.reduce_mean(kernel))
+                kernel_std = float(tf.math.reduce_std(kernel))
                 
                 print(f"   {layer.name}:")
                 print(f"     核形狀: {kernel.shape}")
-                print(f"     核平均值: {kernel.mean():.6f}")
-                print(f"     核標準差: {kernel.std():.6f}")
+                print(f"     核平均值: {kernel_mean:.6f}")
+                print(f"     核標準差: {kernel_std:.6f}")
                 
                 # 檢查是否接近隨機初始化
-                if abs(kernel.mean()) < 0.001 and kernel.std() < 0.05:
+                if abs(kernel_mean) < 0.001 and kernel_std < 0.05:
                     print(f"     ⚠️  權重可能接近零初始化")
                 else:
                     print(f"     ✅ 權重看起來已訓練")
                 
                 if bias is not None:
                     print(f"     偏置形狀: {bias.shape}")
-                    print(f"     偏置平均值: {bias.mean():.6f}")
+                    print(f"     偏置平均值: {float(tf.reduce_mean(bias)):.6f}")
         
         return model
         
@@ -1,7 +1,6 @@
+import functools
 import os
 from pathlib import Path
-from basic_pitch.inference import predict_and_save
-from basic_pitch import ICASSP_2022_MODEL_PATH
 
 def get_available_models():
     """
@@ -21,74 +20,127 @@ def get_available_models():
     # 獲取自訓練模型目錄
     trained_model_dir = Path(__file__).parent / "trained_model"
     
-    if trained_model_dir.exists():
-        # 遍歷所有子目錄尋找模型
-        for model_folder in sorted(trained_model_dir.iterdir()):
-            if model_folder.is_dir():
-                # 檢查是否包含 model.best 資料夾
-                model_best_path = model_folder / "model.best"
-                if model_best_path.exists() and model_best_path.is_dir():
-                    models.append({
-                        "name": f"自訓練模型 - {model_folder.name}",
-                        "path": str(model_best_path),
-                        "is_pretrained": False
-                    })
+    if trained_model_dir.is_dir():
+        # 遍歷所有子目錄尋找模型（DirEntry 會快取檔案類型，不必逐一 stat）
+        with os.scandir(trained_model_dir) as entries:
+            model_folders = sorted(
+                (entry for entry in entries if entry.is_dir()),
+                key=lambda entry: entry.name
+            )
+        
+        for model_folder in model_folders:
+            # 檢查是否包含 model.best 資料夾（is_dir 對不存在的路徑回傳 False）
+            model_best_path = Path(model_folder.path) / "model.best"
+            if model_best_path.is_dir():
+                models.append({
+                    "name": f"自訓練模型 - {model_folder.name}",
+                    "path": str(model_best_path),
+                    "is_pretrained": False
+                })
     
     return models
 
-def wav_to_midi(input_audio_path, output_midi_dir, model_path=None):
+def load_model(model_path=None):
     """
-    Converts a WAV audio file to a MIDI file using the Basic Pitch model.
+    載入並快取 Basic Pitch 模型，同一個模型在整個程序中只載入一次
     Args:
-        input_audio_path (str): 输入的 WAV 文件路径
-        output_midi_dir (str): 输出的 MIDI 文件路径
         model_path (str, optional): 模型路徑，如果為 None 或 "basic-pitch" 則使用預訓練模型
+    Returns:
+        basic_pitch.inference.Model: 已載入的模型
     """
+    # 先統一預訓練模型的名稱，None 與 "basic-pitch" 才會共用同一個快取項目
+    return _load_model("basic-pitch" if model_path is None else model_path)
+
+@functools.lru_cache(maxsize=4)
+def _load_model(model_path):
+    """依正規化後的路徑載入模型（快取鍵）"""
+    # 延遲載入 basic_pitch：它會在 import 時載入 TensorFlow，
+    # 只需要模型列表的請求（如 /models）不必付出這個啟動成本
+    from basic_pitch.inference import Model
+    from basic_pitch import ICASSP_2022_MODEL_PATH
+    
+    # 決定使用哪個模型
+    if model_path == "basic-pitch":
+        print(f"載入預訓練模型: Basic Pitch")
+        return Model(ICASSP_2022_MODEL_PATH)
+    
+    print(f"載入自訓練模型: {model_path}")
+    return Model(model_path)
+
+def wav_to_midi_batch(input_audio_paths, output_midi_dir, model_path=None):
+    """
+    Converts several audio files to MIDI with a single, cached Basic Pitch model.
+    Args:
+        input_audio_paths (list[str]): 輸入的音訊文件路徑列表
+        output_midi_dir (str): 輸出 MIDI 文件的目錄
+        model_path (str, optional): 模型路徑，如果為 None 或 "basic-pitch" 則使用預訓練模型
+    Returns:
+        list: 與輸入順序對應的 MIDI 路徑，轉換失敗的項目為 None
+    """
+    from basic_pitch.inference import predict_and_save
+
     try:
         # 檢查輸入文件
-        if not os.path.exists(input_audio_path):
-            print(f"錯誤：文件 {input_audio_path} 不存在")
-            return
+        existing_paths = []
+        for input_audio_path in input_audio_paths:
+            if os.path.exists(input_audio_path):
+                existing_paths.append(input_audio_path)
+            else:
+                print(f"錯誤：文件 {input_audio_path} 不存在")
+        
+        if not existing_paths:
+            return [None] * len(input_audio_paths)
         
         # 確保輸出目錄存在
         os.makedirs(output_midi_dir, exist_ok=True)
         
-        # 決定使用哪個模型
-        if model_path is None or model_path == "basic-pitch":
-            selected_model = ICASSP_2022_MODEL_PATH
-            print(f"使用預訓練模型: Basic Pitch")
-        else:
-            selected_model = model_path
-            print(f"使用自訓練模型: {model_path}")
+        model = load_model(model_path)
         
-        print(f"開始處理: {input_audio_path}")
+        print(f"開始處理: {', '.join(existing_paths)}")
         
         # 使用正確的參數
         predict_and_save(
-            audio_path_list=[input_audio_path],  # 明確指定參數名
+            audio_path_list=existing_paths,  # 明確指定參數名
             output_directory=output_midi_dir,
             save_midi=True,
             sonify_midi=False,
             save_model_outputs=False,
             save_notes=False,
-            model_or_model_path=selected_model
+            model_or_model_path=model
         )
         
-        # 檢查輸出
+    except Exception as e:
+        print(f"❌ 轉換失敗: {e}")
+        return [None] * len(input_audio_paths)
+    
+    # 檢查輸出
+    results = []
+    for input_audio_path in input_audio_paths:
+        if input_audio_path not in existing_paths:
+            results.append(None)
+            continue
+        
         base_name = os.path.splitext(os.path.basename(input_audio_path))[0]
         expected_midi = os.path.join(output_midi_dir, f"{base_name}_basic_pitch.mid")
         
         if os.path.exists(expected_midi):
             print(f"✓ 轉換成功: {expected_midi}")
-            return expected_midi
+            results.append(expected_midi)
         else:
-            print("⚠ 轉換完成，但未找到輸出文件")
-            return None
-            
-    except Exception as e:
-        print(f"❌ 轉換失敗: {e}")
-        return None
+            print(f"⚠ 轉換完成，但未找到輸出文件: {expected_midi}")
+            results.append(None)
+    
+    return results
 
+def wav_to_midi(input_audio_path, output_midi_dir, model_path=None):
+    """
+    Converts a WAV audio file to a MIDI file using the Basic Pitch model.
+    Args:
+        input_audio_path (str): 输入的 WAV 文件路径
+        output_midi_dir (str): 输出的 MIDI 文件路径
+        model_path (str, optional): 模型路徑，如果為 None 或 "basic-pitch" 則使用預訓練模型
+    """
+    return wav_to_midi_batch([input_audio_path], output_midi_dir, model_path)[0]
 
 if __name__ == "__main__":
     input_wav = "input_audio.wav"
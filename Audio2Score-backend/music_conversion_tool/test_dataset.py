@@ -2,6 +2,7 @@
 import tensorflow as tf
 import numpy as np
 import os
+from pathlib import Path
 
 def test_tfrecord_data(tfrecord_dir):
     """測試TFRecord數據"""
@@ -13,11 +14,10 @@ def test_tfrecord_data(tfrecord_dir):
         return
     
     # 查找TFRecord文件
-    tfrecord_files = []
-    for root, dirs, files in os.walk(tfrecord_dir):
-        for file in files:
-            if file.endswith('.tfrecord') or file.endswith('.tfrecords'):
-                tfrecord_files.append(os.path.join(root, file))
+    tfrecord_files = [
+        str(path) for path in Path(tfrecord_dir).rglob('*')
+        if path.suffix in ('.tfrecord', '.tfrecords')
+    ]
     
     print(f"找到 {len(tfrecord_files)} 個TFRecord文件")
     
@@ -29,8 +29,12 @@ def test_tfrecord_data(tfrecord_dir):
     test_file = tfrecord_files[0]
     print(f"\n測試文件: {test_file}")
     
-    # 創建數據集
-    raw_dataset = tf.data.TFRecordDataset(test_file)
+    # 創建數據集（16MB 讀取緩衝區）
+    raw_dataset = tf.data.TFRecordDataset(
+        test_file,
+        compression_type="",
+        buffer_size=16 << 20,
+    )
     
     # 定義解析函數（根據Basic Pitch的格式）
     feature_description = {
@@ -54,14 +58,18 @@ def test_tfrecord_data(tfrecord_dir):
         
         return audio, {'contour': contours, 'note': notes, 'onset': onsets}
     
-    dataset = raw_dataset.map(parse_example)
+    # 平行解析但保持原順序，take() 每次取到相同的樣本，統計結果可重現
+    options = tf.data.Options()
+    options.experimental_optimization.map_and_batch_fusion = True
+    dataset = raw_dataset.map(parse_example, num_parallel_calls=tf.data.AUTOTUNE).with_options(options)
     
     # 檢查幾個樣本
     print("\n檢查數據樣本:")
     count = 0
     for audio, labels in dataset.take(3):
         print(f"\n樣本 {count + 1}:")
-        print(f"  音頻形狀: {audio.shape}, 範圍: [{audio.numpy().min():.3f}, {audio.numpy().max():.3f}]")
+        audio_np = audio.numpy()  # 只轉換一次
+        print(f"  音頻形狀: {audio.shape}, 範圍: [{audio_np.min():.3f}, {audio_np.max():.3f}]")
         
         for label_name, label in labels.items():
             label_np = label.numpy()
@@ -71,31 +79,46 @@ def test_tfrecord_data(tfrecord_dir):
         
         count += 1
     
-    # 統計信息
+    # 統計信息（串流計算，不保留全部樣本）
     print(f"\n📊 數據統計:")
     total_samples = 0
-    audio_stats = []
-    label_stats = {'contour': [], 'note': [], 'onset': []}
-    
-    for audio, labels in dataset.take(100):  # 檢查前100個
-        total_samples += 1
-        audio_stats.append(audio.numpy())
+    # 音頻平均值/變異數：以 Welford（Chan 合併）方式逐批更新
+    audio_n = 0
+    audio_mean = 0.0
+    audio_m2 = 0.0
+    label_stats = {name: {'pos': 0, 'sum': 0.0, 'total': 0}
+                   for name in ('contour', 'note', 'onset')}
+    
+    batched = dataset.take(100).batch(32).prefetch(tf.data.AUTOTUNE)  # 檢查前100個
+    for audio, labels in batched:
+        audio_np = audio.numpy()
+        total_samples += audio_np.shape[0]
+        
+        cnt = audio_np.size
+        batch_mean = float(audio_np.mean())
+        batch_m2 = float(np.square(audio_np - batch_mean).sum())
+        new_n = audio_n + cnt
+        delta = batch_mean - audio_mean
+        audio_mean += delta * cnt / new_n
+        audio_m2 += batch_m2 + delta * delta * audio_n * cnt / new_n
+        audio_n = new_n
         
         for label_name, label in labels.items():
-            label_stats[label_name].append(label.numpy())
+            label_np = label.numpy()
+            stats = label_stats[label_name]
+            stats['pos'] += int(np.count_nonzero(label_np > 0.5))  # 閾值0.5
+            stats['sum'] += float(label_np.sum(dtype=np.float64))
+            stats['total'] += label_np.size
     
     print(f"   檢查了 {total_samples} 個樣本")
     
-    if audio_stats:
-        all_audio = np.concatenate([a.flatten() for a in audio_stats])
-        print(f"   音頻 - 平均值: {all_audio.mean():.6f}, 標準差: {all_audio.std():.6f}")
+    if audio_n:
+        print(f"   音頻 - 平均值: {audio_mean:.6f}, 標準差: {np.sqrt(audio_m2 / audio_n):.6f}")
     
     for label_name, stats in label_stats.items():
-        if stats:
-            all_labels = np.concatenate([s.flatten() for s in stats])
-            pos_ratio = np.mean(all_labels > 0.5)  # 閾值0.5
-            print(f"   {label_name} - 正樣本比例: {pos_ratio:.2%}, "
-                  f"平均值: {all_labels.mean():.6f}")
+        if stats['total']:
+            print(f"   {label_name} - 正樣本比例: {stats['pos'] / stats['total']:.2%}, "
+                  f"平均值: {stats['sum'] / stats['total']:.6f}")
 
 if __name__ == "__main__":
     test_tfrecord_data("./output_tfrecord")
\ No newline at end of file
@@ -1,10 +1,80 @@
 # test_tfrecord_with_official_parser.py
 import tensorflow as tf
 import numpy as np
+import argparse
+import hashlib
+import itertools
 import os
+import tempfile
+from pathlib import Path
 
-def test_official_parser():
-    """使用 Basic Pitch 官方的 TFRecord 解析器測試"""
+# test_multiple_samples 解析結果的磁碟快取路徑前綴（實際路徑附加文件清單的雜湊）
+PARSED_CACHE_PREFIX = os.path.join(tempfile.gettempdir(), "a2s_tfrecord_cache")
+
+# TFRecord 讀取緩衝區大小（16MB）
+TFRECORD_READ_BUFFER_SIZE = 16 << 20
+
+# TFRecord 特徵結構（同 tf_example_deserialization.py），只建立一次供兩個測試共用
+TFRECORD_SCHEMA = {
+    "file_id": tf.io.FixedLenFeature((), tf.string),
+    "source": tf.io.FixedLenFeature((), tf.string),
+    "audio_wav": tf.io.FixedLenFeature((), tf.string),
+    "notes_indices": tf.io.FixedLenFeature((), tf.string),
+    "notes_values": tf.io.FixedLenFeature((), tf.string),
+    "onsets_indices": tf.io.FixedLenFeature((), tf.string),
+    "onsets_values": tf.io.FixedLenFeature((), tf.string),
+    "contours_indices": tf.io.FixedLenFeature((), tf.string),
+    "contours_values": tf.io.FixedLenFeature((), tf.string),
+    "notes_onsets_shape": tf.io.FixedLenFeature((), tf.string),
+    "contours_shape": tf.io.FixedLenFeature((), tf.string),
+}
+
+
+def find_tfrecord_files(root_dir, limit=None):
+    """遞迴尋找 TFRecord 文件（tf.io.gfile.glob 不支援遞迴的 **）"""
+    # rglob 為惰性產生器，搭配 islice 找到足夠文件後即停止走訪
+    matches = itertools.islice(Path(root_dir).rglob("*.tfrecord"), limit)
+    return [str(path) for path in matches]
+
+
+def parsed_cache_path(tfrecord_files):
+    """依文件清單與各文件的修改時間、大小產生快取路徑；TFRecord 重新產生或換了文件時自動失效"""
+    hasher = hashlib.blake2b(digest_size=8)
+    for file_path in sorted(os.path.abspath(path) for path in tfrecord_files):
+        stat = os.stat(file_path)
+        hasher.update(f"{file_path}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode("utf-8"))
+    return f"{PARSED_CACHE_PREFIX}_{hasher.hexdigest()}"
+
+
+def interleave_tfrecords(tfrecord_files, records_per_file=None):
+    """並行交錯讀取多個 TFRecord 文件，重疊各分片的開檔與讀取延遲"""
+    def read_file(file_path):
+        dataset = tf.data.TFRecordDataset(
+            file_path, compression_type="", buffer_size=TFRECORD_READ_BUFFER_SIZE
+        )
+        if records_per_file is not None:
+            dataset = dataset.take(records_per_file)
+        return dataset
+    
+    # 檢查工具不需要固定順序；並開啟 map + batch 融合
+    options = tf.data.Options()
+    options.deterministic = False
+    options.experimental_optimization.map_and_batch_fusion = True
+    
+    files_ds = tf.data.Dataset.from_tensor_slices(tfrecord_files)
+    return files_ds.interleave(
+        read_file,
+        cycle_length=8,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=False,
+    ).with_options(options)
+
+
+def test_official_parser(dump=False):
+    """使用 Basic Pitch 官方的 TFRecord 解析器測試
+    
+    dump=True 時才將稀疏註釋轉為密集張量輸出；預設直接由稀疏值數量計算非零比例。
+    """
     
     print("=== 使用 Basic Pitch 官方解析器測試 ===")
     
@@ -15,22 +85,12 @@ def test_official_parser():
         print("1. 定義/導入解析函數...")
         
         # 從提供的代碼中複製相關函數
-        def parse_transcription_tfexample(serialized_example):
-            """解析 TFRecord 示例 - 從 tf_example_deserialization.py 複製"""
-            schema = {
-                "file_id": tf.io.FixedLenFeature((), tf.string),
-                "source": tf.io.FixedLenFeature((), tf.string),
-                "audio_wav": tf.io.FixedLenFeature((), tf.string),
-                "notes_indices": tf.io.FixedLenFeature((), tf.string),
-                "notes_values": tf.io.FixedLenFeature((), tf.string),
-                "onsets_indices": tf.io.FixedLenFeature((), tf.string),
-                "onsets_values": tf.io.FixedLenFeature((), tf.string),
-                "contours_indices": tf.io.FixedLenFeature((), tf.string),
-                "contours_values": tf.io.FixedLenFeature((), tf.string),
-                "notes_onsets_shape": tf.io.FixedLenFeature((), tf.string),
-                "contours_shape": tf.io.FixedLenFeature((), tf.string),
-            }
-            example = tf.io.parse_single_example(serialized_example, schema)
+        def parse_transcription_batch(serialized_examples):
+            """批次解析 TFRecord 示例（parse_example 在 C++ 端向量化處理整批）"""
+            return tf.io.parse_example(serialized_examples, TFRECORD_SCHEMA)
+        
+        def parse_transcription_tfexample(example):
+            """解析示例中的序列化張量 - 從 tf_example_deserialization.py 複製"""
             return (
                 example["file_id"],
                 example["source"],
@@ -52,15 +112,18 @@ def test_official_parser():
             sp = tf.SparseTensor(indices=indices, values=values, dense_shape=dense_shape)
             return tf.sparse.to_dense(sp, validate_indices=False)
         
+        def sparse_density(values, dense_shape):
+            """由稀疏值數量計算非零比例，不建立密集張量（空張量視為 0）"""
+            return tf.math.divide_no_nan(
+                tf.cast(tf.shape(values)[0], tf.float64),
+                tf.cast(tf.reduce_prod(dense_shape), tf.float64),
+            )
+        
         print("✅ 解析函數定義完成")
         
         # 找到 TFRecord 文件
         print("\n2. 尋找 TFRecord 文件...")
-        tfrecord_files = []
-        for root, dirs, files in os.walk("./output_tfrecord"):
-            for file in files:
-                if file.endswith('.tfrecord'):
-                    tfrecord_files.append(os.path.join(root, file))
+        tfrecord_files = find_tfrecord_files("./output_tfrecord")
         
         print(f"找到 {len(tfrecord_files)} 個 TFRecord 文件")
         
@@ -68,15 +131,18 @@ def test_official_parser():
             print("❌ 沒有找到 TFRecord 文件")
             return
         
-        # 測試第一個文件
-        test_file = tfrecord_files[0]
-        print(f"\n3. 測試文件: {os.path.basename(test_file)}")
-        
-        # 創建數據集
-        raw_dataset = tf.data.TFRecordDataset(test_file)
+        # 創建數據集（交錯讀取所有文件）
+        print(f"\n3. 測試文件: 交錯讀取 {len(tfrecord_files)} 個文件")
+        raw_dataset = interleave_tfrecords(tfrecord_files)
         
-        # 解析數據
-        parsed_dataset = raw_dataset.map(parse_transcription_tfexample)
+        # 解析數據：先整批 parse_example，再逐一解析序列化張量
+        parsed_dataset = (
+            raw_dataset.batch(64)
+            .map(parse_transcription_batch, num_parallel_calls=tf.data.AUTOTUNE)
+            .unbatch()
+            .map(parse_transcription_tfexample, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE)
+        )
         
         # 檢查第一個樣本
         print("\n4. 檢查第一個樣本:")
@@ -103,25 +169,24 @@ def test_official_parser():
             
             print(f"   音頻形狀: {audio.shape}")
             print(f"   採樣率: {sample_rate}")
-            print(f"   音頻範圍: [{audio.numpy().min():.3f}, {audio.numpy().max():.3f}]")
+            audio_np = audio.numpy()  # 只轉換一次
+            print(f"   音頻範圍: [{audio_np.min():.3f}, {audio_np.max():.3f}]")
             
             # 解析註釋
             print("\n   解析註釋...")
             
-            # 解析 notes
-            notes_dense = sparse2dense(notes_values, notes_indices, notes_onsets_shape)
-            print(f"   notes 形狀: {notes_dense.shape}")
-            print(f"   notes 非零比例: {np.mean(notes_dense.numpy() > 0):.2%}")
-            
-            # 解析 onsets
-            onsets_dense = sparse2dense(onsets_values, onsets_indices, notes_onsets_shape)
-            print(f"   onsets 形狀: {onsets_dense.shape}")
-            print(f"   onsets 非零比例: {np.mean(onsets_dense.numpy() > 0):.2%}")
-            
-            # 解析 contours
-            contours_dense = sparse2dense(contours_values, contours_indices, contours_shape)
-            print(f"   contours 形狀: {contours_dense.shape}")
-            print(f"   contours 非零比例: {np.mean(contours_dense.numpy() > 0):.2%}")
+            annotations = [
+                ("notes", notes_values, notes_indices, notes_onsets_shape),
+                ("onsets", onsets_values, onsets_indices, notes_onsets_shape),
+                ("contours", contours_values, contours_indices, contours_shape),
+            ]
+            for name, values, indices, dense_shape in annotations:
+                print(f"   {name} 形狀: {dense_shape.numpy()}")
+                print(f"   {name} 非零比例: {sparse_density(values, dense_shape).numpy():.2%}")
+                
+                if dump:
+                    dense = sparse2dense(values, indices, dense_shape)
+                    print(f"   {name} 密集張量:\n{dense.numpy()}")
             
             # 檢查形狀是否正確
             print(f"\n   形狀檢查:")
@@ -142,105 +207,102 @@ def test_multiple_samples():
     print("\n=== 測試多個樣本 ===")
     
     try:
-        # 簡化的解析函數
-        def parse_tfrecord(serialized_example):
-            schema = {
-                "file_id": tf.io.FixedLenFeature((), tf.string),
-                "source": tf.io.FixedLenFeature((), tf.string),
-                "audio_wav": tf.io.FixedLenFeature((), tf.string),
-                "notes_indices": tf.io.FixedLenFeature((), tf.string),
-                "notes_values": tf.io.FixedLenFeature((), tf.string),
-                "onsets_indices": tf.io.FixedLenFeature((), tf.string),
-                "onsets_values": tf.io.FixedLenFeature((), tf.string),
-                "contours_indices": tf.io.FixedLenFeature((), tf.string),
-                "contours_values": tf.io.FixedLenFeature((), tf.string),
-                "notes_onsets_shape": tf.io.FixedLenFeature((), tf.string),
-                "contours_shape": tf.io.FixedLenFeature((), tf.string),
-            }
-            return tf.io.parse_single_example(serialized_example, schema)
+        # 簡化的解析函數（批次版本）
+        def parse_tfrecord(serialized_examples):
+            return tf.io.parse_example(serialized_examples, TFRECORD_SCHEMA)
+        
+        # 以圖模式計算註釋密度，整批一次完成
+        def example_densities(fields):
+            notes_values, onsets_values, contours_values, notes_onsets_shape, contours_shape = fields
+            
+            def density(values_str, shape_str):
+                values = tf.io.parse_tensor(values_str, out_type=tf.float32)
+                shape = tf.io.parse_tensor(shape_str, out_type=tf.int64)
+                non_zero_count = tf.cast(tf.shape(values)[0], tf.float32)
+                total_elements = tf.cast(tf.reduce_prod(shape), tf.float32)
+                # 空張量的密度視為 0，避免 NaN/inf 污染平均值
+                return tf.math.divide_no_nan(non_zero_count, total_elements)
+            
+            return tf.stack([
+                density(notes_values, notes_onsets_shape),
+                density(onsets_values, notes_onsets_shape),
+                density(contours_values, contours_shape),
+            ])
+        
+        @tf.function
+        def add_densities(batch):
+            """回傳附加 [batch, 3] 密度向量（notes/onsets/contours）的批次"""
+            densities = tf.map_fn(
+                example_densities,
+                (
+                    batch['notes_values'],
+                    batch['onsets_values'],
+                    batch['contours_values'],
+                    batch['notes_onsets_shape'],
+                    batch['contours_shape'],
+                ),
+                fn_output_signature=tf.float32,
+            )
+            return {**batch, 'densities': densities}
         
         # 找到文件
-        tfrecord_files = []
-        for root, dirs, files in os.walk("./output_tfrecord"):
-            for file in files:
-                if file.endswith('.tfrecord'):
-                    tfrecord_files.append(os.path.join(root, file))
-                    if len(tfrecord_files) >= 3:  # 只取3個文件
-                        break
-            if len(tfrecord_files) >= 3:
-                break
+        tfrecord_files = find_tfrecord_files("./output_tfrecord", limit=3)  # 只取3個文件
         
         print(f"測試 {len(tfrecord_files)} 個文件")
         
-        all_stats = {
-            'audio_lengths': [],
-            'notes_density': [],
-            'onsets_density': [],
-            'contours_density': []
-        }
+        audio_lengths = []
+        density_batches = []
         
-        for i, file_path in enumerate(tfrecord_files):
-            print(f"\n--- 文件 {i+1}: {os.path.basename(file_path)} ---")
-            
-            dataset = tf.data.TFRecordDataset(file_path)
-            parsed_dataset = dataset.map(parse_tfrecord)
+        if not tfrecord_files:
+            print("❌ 沒有找到 TFRecord 文件")
+            return False
+        
+        # 每個文件取3個樣本，交錯讀取後整批解析
+        parsed_dataset = (
+            interleave_tfrecords(tfrecord_files, records_per_file=3)
+            .batch(64)
+            .map(parse_tfrecord, num_parallel_calls=tf.data.AUTOTUNE)
+            .map(add_densities, num_parallel_calls=tf.data.AUTOTUNE)
+            .cache(parsed_cache_path(tfrecord_files))  # 同一批文件再次執行時直接讀取快取，略過解析
+            .prefetch(tf.data.AUTOTUNE)
+        )
+        
+        sample_count = 0
+        for batch in parsed_dataset:
+            # 每批只做一次 numpy() 轉換
+            batch = {key: value.numpy() for key, value in batch.items()}
             
-            sample_count = 0
-            for example in parsed_dataset.take(3):  # 每個文件取3個樣本
+            for j in range(len(batch['file_id'])):
                 sample_count += 1
                 
                 # 解碼音頻
                 audio_decoded = tf.audio.decode_wav(
-                    example['audio_wav'],
+                    batch['audio_wav'][j],
                     desired_channels=1,
                     desired_samples=-1,
                 )
                 audio_length = audio_decoded.audio.shape[0]
-                all_stats['audio_lengths'].append(audio_length)
+                audio_lengths.append(audio_length)
                 
                 print(f"   樣本 {sample_count}:")
                 print(f"     音頻長度: {audio_length} 採樣點")
-                print(f"     文件ID: {example['file_id'].numpy().decode('utf-8')[:50]}...")
-                
-                # 解析稀疏張量
-                def parse_sparse_tensor(values_str, indices_str, shape_str):
-                    values = tf.io.parse_tensor(values_str, out_type=tf.float32)
-                    indices = tf.io.parse_tensor(indices_str, out_type=tf.int64)
-                    shape = tf.io.parse_tensor(shape_str, out_type=tf.int64)
-                    
-                    if tf.size(indices) == 0:
-                        return 0.0
-                    
-                    # 計算密度
-                    total_elements = tf.reduce_prod(shape)
-                    non_zero_count = tf.shape(values)[0]
-                    density = non_zero_count / tf.cast(total_elements, tf.float32)
-                    return density.numpy()
-                
-                # 計算註釋密度
-                notes_density = parse_sparse_tensor(
-                    example['notes_values'],
-                    example['notes_indices'],
-                    example['notes_onsets_shape']
-                )
-                onsets_density = parse_sparse_tensor(
-                    example['onsets_values'],
-                    example['onsets_indices'],
-                    example['notes_onsets_shape']
-                )
-                contours_density = parse_sparse_tensor(
-                    example['contours_values'],
-                    example['contours_indices'],
-                    example['contours_shape']
-                )
-                
-                all_stats['notes_density'].append(notes_density)
-                all_stats['onsets_density'].append(onsets_density)
-                all_stats['contours_density'].append(contours_density)
+                print(f"     文件ID: {batch['file_id'][j].decode('utf-8')[:50]}...")
                 
+                # 註釋密度
+                notes_density, onsets_density, contours_density = batch['densities'][j]
                 print(f"     notes 密度: {notes_density:.4%}")
                 print(f"     onsets 密度: {onsets_density:.4%}")
                 print(f"     contours 密度: {contours_density:.4%}")
+            
+            density_batches.append(batch['densities'])
+        
+        densities = np.concatenate(density_batches)
+        all_stats = {
+            'audio_lengths': audio_lengths,
+            'notes_density': densities[:, 0],
+            'onsets_density': densities[:, 1],
+            'contours_density': densities[:, 2],
+        }
         
         # 統計信息
         print("\n📊 總體統計:")
@@ -262,10 +324,14 @@ def test_multiple_samples():
         return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="測試 TFRecord 數據格式")
+    parser.add_argument("--dump", action="store_true", help="輸出第一個樣本的密集註釋張量")
+    args = parser.parse_args()
+    
     print("開始測試 TFRecord 數據格式...")
     
     # 測試單個樣本
-    success1 = test_official_parser()
+    success1 = test_official_parser(dump=args.dump)
     
     if success1:
         # 測試多個樣本
@@ -3,45 +3,144 @@ API 路由 - Audio2Score Backend
 處理使用者註冊、登入等功能
 """
 import os
-import uuid
+import asyncio
+import multiprocessing
+import hashlib
+import logging
+import time
+import functools
+import asyncpg
+from secrets import token_hex
 from fastapi import APIRouter, HTTPException, status, Request, Depends, Header, File, UploadFile, Form
 from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 import datetime
 from pathlib import Path
 import shutil
+from cachetools import TTLCache
 from music_conversion_tool import music_tool
 
-# Debug: 檢查 runtime 中的 `datetime` 是否被 shadow（啟動時會印出，測試後請移除）
-print("DEBUG: routes module loaded. datetime ->", datetime, type(datetime), "has timezone:", hasattr(datetime, 'timezone'))
-
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 
+from config import settings
 from models import UserCreate, UserLogin, UserWithToken, UserResponse
 from auth import get_password_hash, verify_password, create_access_token, verify_token
-from database import database
+from database import database, USER_BY_ID_QUERY
+
+# 路由日誌（層級由環境變數 LOG_LEVEL 控制，切勿記錄密碼）
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOG_LEVEL)
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
-# 安全檔案名稱處理
+# 基礎上傳目錄（匯入時解析一次，避免每次請求都 resolve）
+_BASE_UPLOADS_DIR = Path(__file__).resolve().parent / "uploads"
+_BASE_UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+
+# 上傳檔案每次讀寫的區塊大小（1MB）
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# 上傳檔名雜湊的金鑰（由 JWT_SECRET 衍生）：uploads/ 以靜態檔案公開提供，
+# 檔名不可由檔案內容直接推算，否則持有相同檔案者即可猜出網址
+_UPLOAD_NAME_KEY = hashlib.blake2b(
+    settings.JWT_SECRET.encode("utf-8"), digest_size=32, person=b"upload-name"
+).digest()
+
+
+def _open_upload_fd(path: Path) -> int:
+    """以原始 fd 開啟上傳暫存檔（不經 Python 緩衝），並提示核心為循序寫入"""
+    # Windows 上低階 fd 預設為文字模式，需加 O_BINARY 以免 \n 被轉成 \r\n
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o644)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    return fd
+
+
+def _write_upload_chunk(fd: int, chunk: bytes) -> None:
+    """將整個區塊寫入 fd（os.write 可能只寫入部分，需迴圈寫完）"""
+    view = memoryview(chunk)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+
+# 音訊轉 MIDI 的程序池（CPU 密集，避免阻塞事件迴圈並繞過 GIL），第一次上傳時才建立
+_conversion_pool: Optional[ProcessPoolExecutor] = None
+
+def get_conversion_pool() -> ProcessPoolExecutor:
+    """取得（必要時建立）音訊轉換程序池"""
+    global _conversion_pool
+    if _conversion_pool is None:
+        # 使用 spawn：伺服器程序已有事件迴圈與執行緒，fork 並不安全
+        _conversion_pool = ProcessPoolExecutor(
+            max_workers=settings.CONVERSION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _conversion_pool
+
+def shutdown_conversion_pool():
+    """關閉音訊轉換程序池（應用程式結束時呼叫）"""
+    global _conversion_pool
+    if _conversion_pool is not None:
+        _conversion_pool.shutdown(wait=False, cancel_futures=True)
+        _conversion_pool = None
+
+# 進行中的 MIDI 轉換（以輸出路徑為鍵）：相同內容同時上傳時共用同一個轉換，
+# 避免兩個工作程序寫同一個輸出檔（basic_pitch 遇到已存在的輸出會拋出 IOError）
+_conversion_tasks: dict = {}
+
+async def convert_to_midi_once(file_path: Path, output_dir: Path, model_path: Optional[str], midi_file_path: Path):
+    """於程序池轉換音訊為 MIDI；同一輸出已在轉換中時等待該轉換完成"""
+    future = _conversion_tasks.get(midi_file_path)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(
+            get_conversion_pool(),
+            music_tool.wav_to_midi,
+            str(file_path),
+            str(output_dir),
+            model_path,
+        )
+        _conversion_tasks[midi_file_path] = future
+        future.add_done_callback(lambda _: _conversion_tasks.pop(midi_file_path, None))
+    # shield：某個請求中斷時不取消其他請求共用的轉換
+    await asyncio.shield(future)
+
+# 認證結果快取：以 Token 雜湊為鍵，只保存使用者公開欄位與 Token 到期時間
+_auth_cache = TTLCache(maxsize=10000, ttl=30)
+# 認證失敗也短暫快取，避免無效 Token 重試時反覆驗證與查詢
+_auth_failure_cache = TTLCache(maxsize=10000, ttl=5)
+# 使用者資料快取：同一使用者以不同 Token 認證時也不必再查資料庫
+_user_cache = TTLCache(maxsize=5000, ttl=60)
+
+# 安全檔案名稱處理：只允許字母、數字（含 Unicode，同 regex 的 \w）、下劃線、點號、破折號
+class _FilenameTranslationTable(dict):
+    """str.translate 用的對照表，不安全字元對應到 '_'，查過的字元會快取"""
+    
+    def __missing__(self, codepoint: int) -> int:
+        char = chr(codepoint)
+        mapped = codepoint if char.isalnum() or char in '_.-' else ord('_')
+        if codepoint < 0x10000:  # 只快取 BMP 範圍，避免對照表無限成長
+            self[codepoint] = mapped
+        return mapped
+
+_FILENAME_TABLE = _FilenameTranslationTable()
+
 def sanitize_filename(filename: str) -> str:
     """清理檔案名稱，移除不安全字元"""
-    # 只允許字母、數字、下劃線、點號、破折號
-    import re
-    filename = re.sub(r'[^\w\.\-]', '_', filename)
-    # 限制長度
-    filename = filename[:100]
-    return filename
+    # 先限制長度再逐字元替換（一對一替換，結果與先替換後截斷相同）
+    return filename[:100].translate(_FILENAME_TABLE)
 
+@functools.lru_cache(maxsize=2048)
 def get_user_upload_dir(username: str, create_if_not_exists: bool = True) -> Path:
-    """取得使用者專屬的上傳目錄"""
+    """取得使用者專屬的上傳目錄（結果快取，每位使用者每個行程只建立一次目錄）"""
     # 清理使用者名稱
     safe_username = sanitize_filename(username)
     
-    # 基礎上傳目錄
-    base_uploads_dir = Path(__file__).resolve().parent / "uploads"
-    
     # 使用者專屬目錄
-    user_upload_dir = base_uploads_dir / safe_username
+    user_upload_dir = _BASE_UPLOADS_DIR / safe_username
     
     if create_if_not_exists:
         user_upload_dir.mkdir(parents=True, exist_ok=True)
@@ -55,34 +154,117 @@ def get_user_upload_dir(username: str, create_if_not_exists: bool = True) -> Pat
     
     return user_upload_dir
 
+# 背景清理舊檔案的間隔（秒）
+CLEANUP_INTERVAL_SECONDS = 3600
+
 def cleanup_old_files(user_upload_dir: Path, max_age_hours: int = 24):
     """清理超過指定時間的舊檔案"""
     try:
-        current_time = datetime.datetime.now().timestamp()
+        current_time = time.time()
         max_age_seconds = max_age_hours * 3600
         
-        for file_path in user_upload_dir.glob('*'):
-            if file_path.is_file():
-                file_age = current_time - file_path.stat().st_mtime
-                if file_age > max_age_seconds:
+        # os.scandir 的 DirEntry 會快取檔案類型，每個檔案只需一次 stat
+        with os.scandir(user_upload_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and current_time - entry.stat().st_mtime > max_age_seconds:
                     try:
-                        file_path.unlink()
-                        print(f"🔄 清理舊檔案: {file_path.name}")
+                        os.unlink(entry.path)
+                        logger.debug("🔄 清理舊檔案: %s", entry.name)
                     except Exception as e:
-                        print(f"⚠️ 清理檔案失敗 {file_path.name}: {e}")
+                        logger.warning("⚠️ 清理檔案失敗 %s: %s", entry.name, e)
     except Exception as e:
-        print(f"⚠️ 清理舊檔案時發生錯誤: {e}")
+        logger.warning("⚠️ 清理舊檔案時發生錯誤: %s", e)
+
+def cleanup_all_users(max_age_hours: int = 24):
+    """清理所有使用者目錄中的舊檔案"""
+    try:
+        with os.scandir(_BASE_UPLOADS_DIR) as entries:
+            user_dirs = [entry.path for entry in entries if entry.is_dir()]
+    except FileNotFoundError:
+        return
+    
+    for user_dir in user_dirs:
+        cleanup_old_files(Path(user_dir), max_age_hours)
+
+async def periodic_cleanup(max_age_hours: int = 24):
+    """背景任務：啟動時先清理一次，之後每小時清理，不佔用上傳請求的時間"""
+    while True:
+        # 檔案系統操作（含列出目錄）在執行緒池中進行，不阻塞事件迴圈
+        await run_in_threadpool(cleanup_all_users, max_age_hours)
+        await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
+
+async def _acquire_conn(pool):
+    """從連線池取得連線，等待逾時或連線數已滿時回傳 503"""
+    try:
+        return await pool.acquire(timeout=settings.DB_ACQUIRE_TIMEOUT)
+    except (asyncio.TimeoutError, asyncpg.TooManyConnectionsError):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="伺服器忙碌中"
+        )
 
-async def get_current_user_from_token(authorization: Optional[str] = Header(None)):
-    """從 Token 取得當前使用者（依賴注入）"""
+@asynccontextmanager
+async def pooled_conn():
+    """借用資料庫連線，離開區塊時歸還連線池"""
+    pool = database.get_pool()
+    if not pool:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="資料庫連線失敗"
+        )
+    
+    conn = await _acquire_conn(pool)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+async def db_conn():
+    """取得資料庫連線（依賴注入），請求結束後自動歸還連線池"""
+    async with pooled_conn() as conn:
+        yield conn
+
+async def bearer_token(authorization: Optional[str] = Header(None)) -> str:
+    """從 Authorization 標頭取出 Bearer Token（依賴注入）"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="未提供認證 Token"
         )
     
-    token = authorization.replace("Bearer ", "")
-    payload = verify_token(token)
+    # 已確認前綴為 "Bearer "，直接切片取出 Token
+    return authorization[7:]
+
+async def get_current_user_from_token(token: str = Depends(bearer_token)):
+    """從 Token 取得當前使用者（依賴注入，結果短暫快取）"""
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    
+    cached = _auth_cache.get(key)
+    if cached is not None:
+        user, expires_at = cached
+        if expires_at > time.time():
+            return user
+        del _auth_cache[key]
+    
+    failure = _auth_failure_cache.get(key)
+    if failure is not None:
+        status_code, detail, headers = failure
+        raise HTTPException(status_code=status_code, detail=detail, headers=headers)
+    
+    try:
+        payload = verify_token(token)
+        user = await _fetch_user_for_payload(payload)
+    except HTTPException as e:
+        # 503 為暫時性錯誤，不快取
+        if e.status_code != status.HTTP_503_SERVICE_UNAVAILABLE:
+            _auth_failure_cache[key] = (e.status_code, e.detail, e.headers)
+        raise
+    
+    _auth_cache[key] = (user, payload.get("exp", float("inf")))
+    return user
+
+async def _fetch_user_for_payload(payload: dict) -> dict:
+    """依 Token 內容查詢使用者"""
     user_id = payload.get("id")
     
     if not user_id:
@@ -91,26 +273,23 @@ async def get_current_user_from_token(authorization: Optional[str] = Header(None
             detail="無效的 Token"
         )
     
-    pool = database.get_pool()
-    if not pool:
+    user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+    
+    # 只在查詢期間借用連線，不使用 db_conn：上傳等長時間請求不應整段佔用連線
+    async with pooled_conn() as conn:
+        user = await conn.fetchrow(USER_BY_ID_QUERY, user_id)
+    
+    if not user:
         raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="資料庫連線失敗"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="使用者不存在"
         )
     
-    async with pool.acquire() as conn:
-        user = await conn.fetchrow(
-            "SELECT id, username, email, created_at FROM users WHERE id = $1",
-            user_id
-        )
-        
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="使用者不存在"
-            )
-        
-        return user
+    user = dict(user)
+    _user_cache[user_id] = user
+    return user
 
 @router.post("/register", response_model=UserWithToken, status_code=status.HTTP_201_CREATED)
 async def register(user: UserCreate, request: Request):
@@ -121,84 +300,63 @@ async def register(user: UserCreate, request: Request):
     - **email**: 電子郵件
     - **password**: 密碼（至少6個字元）
     """
-    print("=" * 60)
-    print("🔵🔵🔵 [後端] register 函數被呼叫")
-    print(f"🔵 [後端] user 物件: {user}")
-    print(f"🔵 [後端] user.username: {user.username}")
-    print(f"🔵 [後端] user.email: {user.email}")
-    print(f"🔵 [後端] user.password: {user.password}")
-    print(f"🔵 [後端] user.password 長度: {len(user.password)}")
-    print(f"🔵 [後端] user.password 型態: {type(user.password)}")
-    print("=" * 60)
-    
     try:
-        print("🟢 [後端] 收到註冊請求")
-        print(f"🟢 [後端] 請求來源: {request.client.host if request.client else '未知'}")
-        print(f"🟢 [後端] 註冊資料: username={user.username}, email={user.email}, password={user.password}")
+        logger.debug(
+            "🟢 收到註冊請求: username=%s, email=%s, client=%s",
+            user.username, user.email,
+            request.client.host if request.client else "未知",
+        )
         
-        pool = database.get_pool()
-        if not pool:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="資料庫連線失敗"
-            )
+        # 加密密碼（bcrypt 為 CPU 密集運算，移至執行緒池避免阻塞事件迴圈）
+        password_hash = await run_in_threadpool(get_password_hash, user.password)
         
-        async with pool.acquire() as conn:
-            # 檢查使用者是否已存在
-            existing_user = await conn.fetchrow(
-                "SELECT * FROM users WHERE email = $1 OR username = $2",
-                user.email, user.username
-            )
-            
-            if existing_user:
-                print("❌ [後端] 使用者名稱或信箱已被使用")
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="使用者名稱或信箱已被使用"
-                )
-            
-            # 加密密碼
-            password_hash = get_password_hash(user.password)
-            
-            # 新增使用者
+        # 新增使用者；username / email 的 UNIQUE 約束衝突時不回傳資料列，
+        # 以單次往返取代「先查詢再新增」（NOW() 在同一交易內為同一值）；
+        # 雜湊完成後才借用連線，bcrypt 計算期間不佔用連線池
+        async with pooled_conn() as conn:
             new_user = await conn.fetchrow(
                 """
                 INSERT INTO users (username, email, password_hash, created_at, updated_at)
-                VALUES ($1, $2, $3, $4, $5)
+                VALUES ($1, $2, $3, NOW() AT TIME ZONE 'UTC', NOW() AT TIME ZONE 'UTC')
+                ON CONFLICT DO NOTHING
                 RETURNING id, username, email, created_at
                 """,
-                user.username, user.email, password_hash, datetime.datetime.utcnow(), datetime.datetime.utcnow()
+                user.username, user.email, password_hash
             )
-            
-            # 建立使用者專屬目錄
-            user_upload_dir = get_user_upload_dir(new_user["username"])
-            print(f"✅ 建立使用者目錄: {user_upload_dir}")
-            
-            # 建立 Token
-            token = create_access_token(
-                data={"id": new_user["id"], "username": new_user["username"]}
+        
+        if new_user is None:
+            logger.debug("❌ 使用者名稱或信箱已被使用: %s", user.username)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="使用者名稱或信箱已被使用"
             )
-            
-            print(f"✅ 新使用者註冊: {user.username} ({user.email})")
-            
-            return {
-                "message": "註冊成功",
-                "user": {
-                    "id": new_user["id"],
-                    "username": new_user["username"],
-                    "email": new_user["email"],
-                    "created_at": new_user["created_at"]
-                },
-                "token": token
-            }
-            
+        
+        # 建立使用者專屬目錄
+        user_upload_dir = get_user_upload_dir(new_user["username"])
+        logger.debug("✅ 建立使用者目錄: %s", user_upload_dir)
+        
+        # 建立 Token
+        token = create_access_token(
+            data={"id": new_user["id"], "username": new_user["username"]}
+        )
+        
+        logger.info("✅ 新使用者註冊: %s (%s)", user.username, user.email)
+        
+        return {
+            "message": "註冊成功",
+            "user": {
+                "id": new_user["id"],
+                "username": new_user["username"],
+                "email": new_user["email"],
+                "created_at": new_user["created_at"]
+            },
+            "token": token
+        }
+        
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌❌❌ 註冊錯誤 ❌❌❌")
-        print(f"錯誤訊息: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 註冊錯誤")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"伺服器錯誤: {str(e)}"
@@ -212,74 +370,54 @@ async def login(credentials: UserLogin, request: Request):
     - **email**: 電子郵件
     - **password**: 密碼
     """
-    print("=" * 60)
-    print("🔵🔵🔵 [後端] login 函數被呼叫")
-    print(f"🔵 [後端] credentials 物件: {credentials}")
-    print(f"🔵 [後端] credentials.email: {credentials.email}")
-    print(f"🔵 [後端] credentials.password: {credentials.password}")
-    print(f"🔵 [後端] credentials.password 長度: {len(credentials.password)}")
-    print(f"🔵 [後端] credentials.password 型態: {type(credentials.password)}")
-    print("=" * 60)
-    
     try:
-        print("🟢 [後端] 收到登入請求")
-        print(f"🟢 [後端] 請求來源: {request.client.host if request.client else '未知'}")
-        print(f"🟢 [後端] 登入資料: email={credentials.email}, password={credentials.password}, type={type(credentials.password)}")
+        logger.debug(
+            "🟢 收到登入請求: email=%s, client=%s",
+            credentials.email,
+            request.client.host if request.client else "未知",
+        )
         
-        pool = database.get_pool()
-        if not pool:
+        # 查詢使用者（查完即歸還連線，驗證密碼期間不佔用連線池）
+        async with pooled_conn() as conn:
+            user = await conn.fetchrow(database.user_by_email_query, credentials.email)
+        
+        if not user:
+            logger.debug("❌ 帳號不存在: %s", credentials.email)
             raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="資料庫連線失敗"
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="帳號或密碼錯誤"
             )
         
-        async with pool.acquire() as conn:
-            # 查詢使用者
-            user = await conn.fetchrow(
-                "SELECT * FROM users WHERE email = $1",
-                credentials.email
-            )
-            
-            if not user:
-                print("❌ [後端] 帳號不存在")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="帳號或密碼錯誤"
-                )
-            
-            # 驗證密碼
-            if not verify_password(credentials.password, user["password_hash"]):
-                print("❌ [後端] 密碼錯誤")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="帳號或密碼錯誤"
-                )
-            
-            # 建立 Token
-            token = create_access_token(
-                data={"id": user["id"], "username": user["username"]}
+        # 驗證密碼（於執行緒池中執行 bcrypt）
+        if not await run_in_threadpool(verify_password, credentials.password, user["password_hash"]):
+            logger.debug("❌ 密碼錯誤: %s", credentials.email)
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="帳號或密碼錯誤"
             )
-            
-            print(f"✅ 使用者登入: {user['username']} ({user['email']})")
-            
-            return {
-                "message": "登入成功",
-                "user": {
-                    "id": user["id"],
-                    "username": user["username"],
-                    "email": user["email"],
-                    "created_at": user["created_at"]
-                },
-                "token": token
-            }
-            
+        
+        # 建立 Token
+        token = create_access_token(
+            data={"id": user["id"], "username": user["username"]}
+        )
+        
+        logger.info("✅ 使用者登入: %s (%s)", user['username'], user['email'])
+        
+        return {
+            "message": "登入成功",
+            "user": {
+                "id": user["id"],
+                "username": user["username"],
+                "email": user["email"],
+                "created_at": user["created_at"]
+            },
+            "token": token
+        }
+        
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌❌❌ 登入錯誤 ❌❌❌")
-        print(f"錯誤訊息: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 登入錯誤")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"伺服器錯誤: {str(e)}"
@@ -292,12 +430,8 @@ async def get_current_user(user = Depends(get_current_user_from_token)):
     
     需要在 Header 中提供 Authorization: Bearer <token>
     """
-    return {
-        "id": user["id"],
-        "username": user["username"],
-        "email": user["email"],
-        "created_at": user["created_at"]
-    }
+    # 欄位已與 UserResponse 一致，直接交由 response_model 驗證
+    return user
 
 # 創建專門處理上傳的路由
 upload_router = APIRouter(prefix="/api/upload", tags=["File Upload"])
@@ -309,12 +443,10 @@ async def get_models():
     """
     try:
         models = music_tool.get_available_models()
-        print(f"🔵 [模型列表] 找到 {len(models)} 個可用模型")
+        logger.debug("🔵 [模型列表] 找到 %d 個可用模型", len(models))
         return {"models": models}
     except Exception as e:
-        print(f"❌ [模型列表] 錯誤: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ [模型列表] 錯誤")
         return JSONResponse(
             status_code=500,
             content={"error": f"獲取模型列表失敗: {str(e)}"}
@@ -331,10 +463,11 @@ async def upload_file(
     支援選擇不同的模型進行轉換
     """
     try:
-        print("🔵 [上傳] 開始處理檔案上傳...")
-        print(f"🔵 [上傳] 使用者: {user['username']} (ID: {user['id']})")
-        print(f"🔵 [上傳] 選擇的模型: {model_path if model_path else 'Basic Pitch (預訓練)'}")
-        print("REQ-DEBUG datetime ->", datetime, type(datetime), "has timezone:", hasattr(datetime, 'timezone'))
+        logger.debug(
+            "🔵 [上傳] 開始處理檔案上傳: user=%s (id=%s), model=%s",
+            user['username'], user['id'],
+            model_path or "Basic Pitch (預訓練)",
+        )
 
         # 基本檢查
         if not file.filename:
@@ -343,26 +476,6 @@ async def upload_file(
                 content={"error": "沒有收到檔案"}
             )
 
-        # 安全檢查：檔案大小限制 (50MB)
-        max_file_size = 50 * 1024 * 1024  # 50MB
-        file_size = 0
-        
-        # 讀取並檢查檔案內容
-        contents = await file.read()
-        file_size = len(contents)
-        
-        if file_size > max_file_size:
-            return JSONResponse(
-                status_code=400,
-                content={"error": f"檔案大小超過限制 (最大 {max_file_size//1024//1024}MB)"}
-            )
-        
-        if file_size == 0:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "檔案為空"}
-            )
-
         # 保留原始檔案名稱（用於顯示）
         original_filename = file.filename
         
@@ -372,10 +485,10 @@ async def upload_file(
             decoded_filename = unquote(original_filename)
             # 如果解碼後不同，使用解碼後的檔名
             if decoded_filename != original_filename:
-                print(f"🔵 [上傳] 解碼檔名: {original_filename} -> {decoded_filename}")
+                logger.debug("🔵 [上傳] 解碼檔名: %s -> %s", original_filename, decoded_filename)
                 original_filename = decoded_filename
         except Exception as e:
-            print(f"⚠️ [上傳] 解碼檔名失敗: {e}")
+            logger.warning("⚠️ [上傳] 解碼檔名失敗: %s", e)
         
         # 清理檔案名稱（用於儲存）
         safe_filename = sanitize_filename(original_filename)
@@ -383,73 +496,109 @@ async def upload_file(
         # 取得使用者專屬目錄
         user_upload_dir = get_user_upload_dir(user['username'])
         
-        # 清理舊檔案（保留最近24小時的檔案）
-        cleanup_old_files(user_upload_dir, max_age_hours=24)
-        
-        # 產生唯一檔案名稱避免衝突
+        # 保留副檔名
         file_extension = Path(safe_filename).suffix
-        unique_filename = f"{uuid.uuid4().hex}{file_extension}"
-        file_path = user_upload_dir / unique_filename
-        
-        # 儲存上傳的檔案
-        with open(file_path, "wb") as f:
-            f.write(contents)
         
-        print(f"✅ [上傳] 收到檔案: {original_filename} (清理後: {safe_filename}) -> {unique_filename}, 大小: {file_size} bytes")
-        print(f"✅ [上傳] 儲存路徑: {file_path}")
-
-        # 轉換為 MIDI
-        print(f"✅ 開始預測處理檔案: {unique_filename}")
+        # 安全檢查：檔案大小限制 (50MB)
+        max_file_size = 50 * 1024 * 1024  # 50MB
+        file_size = 0
         
+        # 分塊串流寫入暫存檔，不將整個檔案讀入記憶體；同時計算內容雜湊
+        temp_path = user_upload_dir / f".{token_hex(16)}{file_extension}.part"
+        hasher = hashlib.blake2b(digest_size=16, key=_UPLOAD_NAME_KEY)
+        fd = await run_in_threadpool(_open_upload_fd, temp_path)
         try:
-            # 轉換檔案，使用指定的模型
-            music_tool.wav_to_midi(str(file_path), str(user_upload_dir), model_path)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > max_file_size:
+                    break
+                hasher.update(chunk)
+                await run_in_threadpool(_write_upload_chunk, fd, chunk)
+        finally:
+            await run_in_threadpool(os.close, fd)
+        
+        if file_size > max_file_size or file_size == 0:
+            temp_path.unlink(missing_ok=True)
+            if file_size > max_file_size:
+                error = f"檔案大小超過限制 (最大 {max_file_size//1024//1024}MB)"
+            else:
+                error = "檔案為空"
+            return JSONResponse(
+                status_code=400,
+                content={"error": error}
+            )
+        
+        # 以內容雜湊（含所選模型）命名：相同檔案重複上傳時可直接沿用先前的 MIDI
+        hasher.update((model_path or "").encode("utf-8"))
+        unique_filename = f"{hasher.hexdigest()}{file_extension}"
+        file_path = user_upload_dir / unique_filename
+        if file_path.exists():
+            # 相同內容已存在（可能正被轉換程序讀取）：沿用既有檔案，不覆寫
+            temp_path.unlink(missing_ok=True)
+            os.utime(file_path)
+        else:
+            os.replace(temp_path, file_path)
+        
+        midi_filename = f"{Path(unique_filename).stem}_basic_pitch.mid"
+        midi_file_path = user_upload_dir / midi_filename
+        
+        logger.debug(
+            "✅ [上傳] 收到檔案: %s (清理後: %s) -> %s, 大小: %d bytes",
+            original_filename, safe_filename, file_path, file_size,
+        )
+
+        if midi_file_path.exists():
+            # 重複上傳：略過轉換，並更新修改時間避免被舊檔清理刪除
+            os.utime(midi_file_path)
+            logger.info("✅ 沿用既有 MIDI: %s", midi_filename)
+        else:
+            # 轉換為 MIDI
+            try:
+                # 轉換檔案，使用指定的模型（於程序池執行，不阻塞其他請求）
+                await convert_to_midi_once(file_path, user_upload_dir, model_path, midi_file_path)
+            except Exception as conversion_error:
+                if midi_file_path.exists():
+                    # 輸出已由其他轉換產生（例如輸出已存在的 IOError），視為成功
+                    logger.info("✅ MIDI 已由其他轉換產生: %s", midi_filename)
+                else:
+                    logger.exception("❌ 轉換過程錯誤")
+                    # 如果轉換失敗，刪除上傳的檔案
+                    try:
+                        file_path.unlink(missing_ok=True)
+                    except Exception as cleanup_error:
+                        logger.warning("⚠️ 清理失敗檔案時發生錯誤: %s", cleanup_error)
+                    
+                    return JSONResponse(
+                        status_code=500,
+                        content={"error": f"檔案轉換失敗: {str(conversion_error)}"}
+                    )
             
             # 檢查是否成功產生 MIDI 檔案
-            midi_filename = f"{Path(unique_filename).stem}_basic_pitch.mid"
-            midi_file_path = user_upload_dir / midi_filename
-            
-            if midi_file_path.exists():
-                print(f"✅ MIDI 轉換成功: {midi_filename}")
-                
-                # 回傳轉換結果
-                return {
-                    "status": "success",
-                    "message": "檔案轉換成功",
-                    "original_filename": original_filename,  # 使用原始檔名
-                    "saved_filename": unique_filename,
-                    "midi_filename": midi_filename,
-                    "size": file_size,
-                    "content_type": file.content_type,
-                    "upload_time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-                    "user": user['username']
-                }
-            else:
-                print("❌ MIDI 檔案未產生")
+            if not midi_file_path.exists():
+                logger.error("❌ MIDI 檔案未產生: %s", unique_filename)
                 return JSONResponse(
                     status_code=500,
                     content={"error": "MIDI 轉換失敗，未產生輸出檔案"}
                 )
-                
-        except Exception as conversion_error:
-            print(f"❌ 轉換過程錯誤: {conversion_error}")
-            # 如果轉換失敗，刪除上傳的檔案
-            try:
-                if file_path.exists():
-                    file_path.unlink()
-            except Exception as cleanup_error:
-                print(f"⚠️ 清理失敗檔案時發生錯誤: {cleanup_error}")
             
-            return JSONResponse(
-                status_code=500,
-                content={"error": f"檔案轉換失敗: {str(conversion_error)}"}
-            )
+            logger.info("✅ MIDI 轉換成功: %s", midi_filename)
+        
+        # 回傳轉換結果
+        return {
+            "status": "success",
+            "message": "檔案轉換成功",
+            "original_filename": original_filename,  # 使用原始檔名
+            "saved_filename": unique_filename,
+            "midi_filename": midi_filename,
+            "size": file_size,
+            "content_type": file.content_type,
+            "upload_time": datetime.datetime.now(datetime.timezone.utc),
+            "user": user['username']
+        }
 
     except Exception as e:
-        # 印出完整 traceback 到 server 日誌，避免只回傳簡短錯誤
-        import traceback
-        print(f"❌ [上傳] 錯誤: {str(e)}")
-        traceback.print_exc()
+        # 記錄完整 traceback 到 server 日誌，避免只回傳簡短錯誤
+        logger.exception("❌ [上傳] 錯誤")
         return JSONResponse(
             status_code=500, 
             content={"error": f"伺服器錯誤: {str(e)}"}
@@ -466,7 +615,8 @@ async def get_user_files(user = Depends(get_current_user_from_token)):
         
         files = []
         for file_path in user_upload_dir.glob('*'):
-            if file_path.is_file():
+            # 略過上傳中的暫存檔（以 . 開頭）
+            if file_path.is_file() and not file_path.name.startswith('.'):
                 files.append({
                     "filename": file_path.name,
                     "size": file_path.stat().st_size,
@@ -479,7 +629,7 @@ async def get_user_files(user = Depends(get_current_user_from_token)):
         return {"files": sorted(files, key=lambda x: x["modified"], reverse=True)}
     
     except Exception as e:
-        print(f"❌ 取得檔案列表錯誤: {e}")
+        logger.exception("❌ 取得檔案列表錯誤")
         return JSONResponse(
             status_code=500,
             content={"error": f"取得檔案列表失敗: {str(e)}"}
@@ -498,8 +648,8 @@ async def delete_user_file(
         user_upload_dir = get_user_upload_dir(user['username'], create_if_not_exists=False)
         file_path = user_upload_dir / safe_filename
         
-        # 額外安全檢查：確保檔案在使用者目錄內
-        if not file_path.resolve().parent.samefile(user_upload_dir.resolve()):
+        # 額外安全檢查：確保檔案直接位於使用者目錄內（比較解析後的路徑，不需額外 stat）
+        if file_path.resolve().parent != user_upload_dir.resolve():
             return JSONResponse(
                 status_code=400,
                 content={"error": "無效的檔案路徑"}
@@ -513,11 +663,11 @@ async def delete_user_file(
         
         file_path.unlink()
         
-        print(f"✅ 刪除檔案: {user['username']}/{safe_filename}")
+        logger.info("✅ 刪除檔案: %s/%s", user['username'], safe_filename)
         return {"status": "success", "message": "檔案刪除成功"}
     
     except Exception as e:
-        print(f"❌ 刪除檔案錯誤: {e}")
+        logger.exception("❌ 刪除檔案錯誤")
         return JSONResponse(
             status_code=500,
             content={"error": f"刪除檔案失敗: {str(e)}"}
@@ -532,13 +682,10 @@ async def save_to_library(
 ):
     """保存檔案記錄到圖書館"""
     try:
+        # 先讀完請求內容再借用連線，避免慢速客戶端上傳 body 時佔用連線池
         data = await request.json()
         
-        pool = database.get_pool()
-        if not pool:
-            raise HTTPException(status_code=503, detail="資料庫連線失敗")
-        
-        async with pool.acquire() as conn:
+        async with pooled_conn() as conn:
             record_id = await conn.fetchval('''
                 INSERT INTO file_records (
                     user_id, original_filename, saved_filename, file_type, file_size,
@@ -555,11 +702,13 @@ async def save_to_library(
                 data.get('midi_filename')
             )
         
-        print(f"✅ 保存檔案記錄: {user['username']} - {data.get('original_filename')}")
+        logger.info("✅ 保存檔案記錄: %s - %s", user['username'], data.get('original_filename'))
         return {"status": "success", "record_id": record_id}
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ 保存檔案記錄錯誤: {e}")
+        logger.exception("❌ 保存檔案記錄錯誤")
         return JSONResponse(
             status_code=500,
             content={"error": f"保存失敗: {str(e)}"}
@@ -570,58 +719,54 @@ async def get_library(
     sort_by: str = "date",
     filter_type: str = "all",
     search: str = "",
-    user = Depends(get_current_user_from_token)
+    user = Depends(get_current_user_from_token),
+    conn = Depends(db_conn)
 ):
     """獲取使用者的圖書館檔案列表"""
     try:
-        pool = database.get_pool()
-        if not pool:
-            raise HTTPException(status_code=503, detail="資料庫連線失敗")
-        
-        async with pool.acquire() as conn:
-            query = '''
-                SELECT id, original_filename, saved_filename, file_type, file_size,
-                       wav_filename, midi_filename, is_favorited, upload_date, created_at
-                FROM file_records
-                WHERE user_id = $1
-            '''
-            params = [user['id']]
-            
-            if filter_type == "favorites":
-                query += " AND is_favorited = TRUE"
-            elif filter_type == "midi":
-                query += " AND midi_filename IS NOT NULL"
-            
-            if search:
-                query += " AND original_filename ILIKE $" + str(len(params) + 1)
-                params.append(f"%{search}%")
-            
-            if sort_by == "name":
-                query += " ORDER BY original_filename ASC"
-            else:
-                query += " ORDER BY upload_date DESC"
-            
-            records = await conn.fetch(query, *params)
-            
-            files = []
-            for record in records:
-                files.append({
-                    "id": record['id'],
-                    "original_filename": record['original_filename'],
-                    "saved_filename": record['saved_filename'],
-                    "file_type": record['file_type'],
-                    "file_size": record['file_size'],
-                    "wav_filename": record['wav_filename'],
-                    "midi_filename": record['midi_filename'],
-                    "is_favorited": record['is_favorited'],
-                    "upload_date": record['upload_date'].isoformat() if record['upload_date'] else None,
-                    "created_at": record['created_at'].isoformat() if record['created_at'] else None
-                })
+        query = '''
+            SELECT id, original_filename, saved_filename, file_type, file_size,
+                   wav_filename, midi_filename, is_favorited, upload_date, created_at
+            FROM file_records
+            WHERE user_id = $1
+        '''
+        params = [user['id']]
+        
+        if filter_type == "favorites":
+            query += " AND is_favorited = TRUE"
+        elif filter_type == "midi":
+            query += " AND midi_filename IS NOT NULL"
+        
+        if search:
+            query += " AND original_filename ILIKE $" + str(len(params) + 1)
+            params.append(f"%{search}%")
+        
+        if sort_by == "name":
+            query += " ORDER BY original_filename ASC"
+        else:
+            query += " ORDER BY upload_date DESC"
+        
+        records = await conn.fetch(query, *params)
+        
+        files = []
+        for record in records:
+            files.append({
+                "id": record['id'],
+                "original_filename": record['original_filename'],
+                "saved_filename": record['saved_filename'],
+                "file_type": record['file_type'],
+                "file_size": record['file_size'],
+                "wav_filename": record['wav_filename'],
+                "midi_filename": record['midi_filename'],
+                "is_favorited": record['is_favorited'],
+                "upload_date": record['upload_date'],
+                "created_at": record['created_at']
+            })
         
         return {"files": files, "total": len(files)}
     
     except Exception as e:
-        print(f"❌ 獲取圖書館錯誤: {e}")
+        logger.exception("❌ 獲取圖書館錯誤")
         return JSONResponse(
             status_code=500,
             content={"error": f"獲取失敗: {str(e)}"}
@@ -630,38 +775,34 @@ async def get_library(
 @upload_router.post("/library/{file_id}/favorite")
 async def toggle_favorite(
     file_id: int,
-    user = Depends(get_current_user_from_token)
+    user = Depends(get_current_user_from_token),
+    conn = Depends(db_conn)
 ):
     """切換收藏狀態"""
     try:
-        pool = database.get_pool()
-        if not pool:
-            raise HTTPException(status_code=503, detail="資料庫連線失敗")
-        
-        async with pool.acquire() as conn:
-            record = await conn.fetchrow('''
-                SELECT id, is_favorited FROM file_records
-                WHERE id = $1 AND user_id = $2
-            ''', file_id, user['id'])
-            
-            if not record:
-                return JSONResponse(
-                    status_code=404,
-                    content={"error": "檔案不存在"}
-                )
-            
-            new_status = not record['is_favorited']
-            await conn.execute('''
-                UPDATE file_records
-                SET is_favorited = $1
-                WHERE id = $2
-            ''', new_status, file_id)
-        
-        print(f"✅ 切換收藏: {file_id} -> {new_status}")
+        record = await conn.fetchrow('''
+            SELECT id, is_favorited FROM file_records
+            WHERE id = $1 AND user_id = $2
+        ''', file_id, user['id'])
+        
+        if not record:
+            return JSONResponse(
+                status_code=404,
+                content={"error": "檔案不存在"}
+            )
+        
+        new_status = not record['is_favorited']
+        await conn.execute('''
+            UPDATE file_records
+            SET is_favorited = $1
+            WHERE id = $2
+        ''', new_status, file_id)
+        
+        logger.debug("✅ 切換收藏: %s -> %s", file_id, new_status)
         return {"status": "success", "is_favorited": new_status}
     
     except Exception as e:
-        print(f"❌ 切換收藏錯誤: {e}")
+        logger.exception("❌ 切換收藏錯誤")
         return JSONResponse(
             status_code=500,
             content={"error": f"切換失敗: {str(e)}"}
@@ -670,35 +811,31 @@ async def toggle_favorite(
 @upload_router.delete("/library/{file_id}")
 async def delete_library_file(
     file_id: int,
-    user = Depends(get_current_user_from_token)
+    user = Depends(get_current_user_from_token),
+    conn = Depends(db_conn)
 ):
     """從圖書館刪除檔案記錄"""
     try:
-        pool = database.get_pool()
-        if not pool:
-            raise HTTPException(status_code=503, detail="資料庫連線失敗")
-        
-        async with pool.acquire() as conn:
-            record = await conn.fetchrow('''
-                SELECT * FROM file_records
-                WHERE id = $1 AND user_id = $2
-            ''', file_id, user['id'])
-            
-            if not record:
-                return JSONResponse(
-                    status_code=404,
-                    content={"error": "檔案不存在"}
-                )
-            
-            await conn.execute('''
-                DELETE FROM file_records WHERE id = $1
-            ''', file_id)
+        record = await conn.fetchrow('''
+            SELECT * FROM file_records
+            WHERE id = $1 AND user_id = $2
+        ''', file_id, user['id'])
+        
+        if not record:
+            return JSONResponse(
+                status_code=404,
+                content={"error": "檔案不存在"}
+            )
+        
+        await conn.execute('''
+            DELETE FROM file_records WHERE id = $1
+        ''', file_id)
         
-        print(f"✅ 刪除檔案記錄: {file_id}")
+        logger.info("✅ 刪除檔案記錄: %s", file_id)
         return {"status": "success", "message": "檔案刪除成功"}
     
     except Exception as e:
-        print(f"❌ 刪除檔案記錄錯誤: {e}")
+        logger.exception("❌ 刪除檔案記錄錯誤")
         return JSONResponse(
             status_code=500,
             content={"error": f"刪除失敗: {str(e)}"}